@@ -1,17 +1,83 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import os
+import asyncio
 import csv
 import json
+import re
+import html
+import functools
+import string
+import threading
+import numpy as np
 from datetime import datetime
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from tavily import TavilyClient
+
+# orjson is an optional C-accelerated encoder; stdlib json is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # --- PAGE CONFIGURATION (Must be the first Streamlit command) ---
 st.set_page_config(layout="wide", page_title="Agent Verification Lab")
 
+# --- STATIC TEMPLATES (built once at import, not on every rerun) ---
+# Added JSON instructions back in so the highlighter works!
+# Sent as a fixed system message, byte-for-byte identical on every call, with the
+# source text strictly after it: that lets Groq reuse its prefix (KV) cache. Any edit
+# here resets that cache, so never interpolate per-request values into this string.
+SYSTEM_PROMPT = """You are a strict financial verification assistant. You will be provided with a user query and raw source context. You must adhere strictly to the following rules:
+1. Base your answer solely on the provided raw context.
+2. Do not use any internal knowledge, external facts, or assumptions.
+3. Your final response must be exactly two sentences long.
+
+You MUST return your response as a valid JSON object with exactly two keys:
+"claim": "Your summary here",
+"exact_quote": "Copy and paste the EXACT word-for-word sentence from the text that proves your claim. If you cannot find one, leave this empty."
+
+The context may be cut off at the end; do not assume anything about the missing part."""
+
+READER_TPL = string.Template("""
+<div style="border: 1px solid #ddd; border-radius: 8px; padding: 20px; height: 400px; overflow-y: auto; background-color: #f9f9f9; color: #2c3e50; font-family: 'Arial', sans-serif; font-size: 15px; line-height: 1.6; box-shadow: inset 0 0 10px rgba(0,0,0,0.05);">
+    $content
+</div>
+""")
+
+# Keeps st.info/st.markdown from reading "$...$" as LaTeX or "<...>" as a tag
+_MARKDOWN_ESCAPE = str.maketrans({"$": r"\$", "<": "&lt;"})
+
+@functools.lru_cache(maxsize=32)
+def escape_markdown(text):
+    # The review screen re-renders the same claim on every rerun, so results are memoized
+    return text.translate(_MARKDOWN_ESCAPE) if any(c in text for c in "$<") else text
+
+def dump_json(record):
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(record, indent=2, ensure_ascii=False)
+
+SESSION_DEFAULTS = {
+    "step": "input",
+    "topic": "",
+    "research_data": None,
+    "ai_summary": "",
+    "exact_quote": "",
+    "verification_status": None,
+    "experiment_mode": "Source-Grounded (Experimental)",
+    "start_time": None, # <-- TIMER START STATE
+    "verification_time": None, # <-- TIMER END STATE
+    "log_json": "",
+    "agent_model": "",
+}
+
 # --- SECURITY SETUP ---
-load_dotenv()
+# Cached so the .env file is parsed once per process, not on every rerun
+@st.cache_resource(show_spinner=False)
+def load_env():
+    load_dotenv()
+
+load_env()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
@@ -21,15 +87,200 @@ if not GROQ_API_KEY or not TAVILY_API_KEY:
     st.stop()
 
 # --- INITIALIZE CLIENTS ---
-llm = ChatGroq(temperature=0, model_name="llama-3.3-70b-versatile", groq_api_key=GROQ_API_KEY)
-tavily = TavilyClient(api_key=TAVILY_API_KEY)
+# The 70B model stays the default so human-verified runs match the earlier data; the fast
+# 8B model is opt-in by turning off the sidebar "High-accuracy mode" toggle. Every logged
+# row records which model produced its claim.
+SMALL_MODEL = "llama-3.1-8b-instant"
+LARGE_MODEL = "llama-3.3-70b-versatile"
+
+# The SDK imports live inside the factories: reruns that never call the agent
+# (radio toggles, Restart, the review screen) don't pay for langchain/tavily imports.
+def build_llm(model_name, http_client=None):
+    from langchain_groq import ChatGroq
+    return ChatGroq(temperature=0, model_name=model_name, groq_api_key=GROQ_API_KEY, http_client=http_client)
+
+# Built once per process and shared across reruns/sessions (keeps HTTP pools warm)
+@st.cache_resource(show_spinner=False)
+def get_http_client():
+    # One keep-alive pool for every Groq model, so switching models reuses the same TLS connections
+    import httpx
+    return httpx.Client(timeout=30, limits=httpx.Limits(max_keepalive_connections=20, max_connections=40))
+
+@st.cache_resource(show_spinner=False)
+def get_llm(model_name):
+    return build_llm(model_name, http_client=get_http_client())
+
+@st.cache_resource(show_spinner=False)
+def get_tavily():
+    from tavily import TavilyClient
+    return TavilyClient(api_key=TAVILY_API_KEY)
+
+# --- AGENT CALLS ---
+# Search and summarization are pure functions of their input, so repeated topics
+# (e.g. replaying the trap dataset) are served from memory instead of the network
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def run_search(topic):
+    search_result = get_tavily().search(query=topic, search_depth="basic", max_results=1)
+    return search_result.get('results', [])
+
+# Only the top of the article is needed for a 2-sentence claim; capping the input
+# (~800 tokens) keeps prefill cost flat when Tavily returns multi-KB snippets.
+MAX_SOURCE_CHARS = 3200
+
+def truncate_source(source_text):
+    if len(source_text) <= MAX_SOURCE_CHARS:
+        return source_text
+    # Cut on a word boundary so the model never sees half a number or name
+    return source_text[:MAX_SOURCE_CHARS].rsplit(" ", 1)[0]
+
+def build_messages(source_text):
+    return [("system", SYSTEM_PROMPT), ("human", f"Text Context:\n{source_text}")]
+
+def parse_response(response_text):
+    # Returns (claim, exact_quote); falls back to the raw text if the model skipped the JSON
+    try:
+        clean_text = response_text.replace('```json', '').replace('```', '').strip()
+        parsed_data = json.loads(clean_text)
+        return parsed_data.get("claim", "Error extracting claim."), parsed_data.get("exact_quote", "")
+    except json.JSONDecodeError:
+        return response_text, ""
+
+# --- SUMMARY CACHE ---
+# Exact repeats of a source text are served from a dict; near-duplicates (common when
+# re-phrasing the same topic) reuse an earlier summary instead of paying for another
+# LLM call. Fingerprint = normalized float32 embedding; a hit is cosine similarity
+# >= threshold against anything stored.
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SUMMARY_CACHE_SIZE = 512
+
+@st.cache_resource(show_spinner=False)
+def get_embedder():
+    # Optional dependency: without sentence-transformers the semantic layer is skipped
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        return None
+    return SentenceTransformer("all-MiniLM-L6-v2")
+
+# One cache per model, so toggling High-accuracy mode never serves the other model's output
+@st.cache_resource(show_spinner=False)
+def get_summary_cache(model_name):
+    return {"exact": {}, "embeddings": None, "summaries": [], "lock": threading.Lock()}
+
+def lookup_summary(source_text, model_name):
+    # Returns (cached summary or None, embedding to store alongside a fresh summary)
+    cache = get_summary_cache(model_name)
+    with cache["lock"]:
+        if source_text in cache["exact"]:
+            return cache["exact"][source_text], None
+
+    embedder = get_embedder()
+    if embedder is None:
+        return None, None
+
+    embedding = embedder.encode(source_text, normalize_embeddings=True).astype(np.float32)
+    with cache["lock"]:
+        if cache["embeddings"] is not None:
+            scores = cache["embeddings"] @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] >= SEMANTIC_CACHE_THRESHOLD:
+                cached = cache["summaries"][best]
+                # The cached claim came from a different article: only reuse it if its
+                # evidence quote is verbatim in this source, otherwise it isn't grounded here
+                _, quote = parse_response(cached)
+                if quote and quote in source_text:
+                    return cached, embedding
+    return None, embedding
+
+def store_summary(source_text, model_name, embedding, summary):
+    cache = get_summary_cache(model_name)
+    with cache["lock"]:
+        cache["exact"][source_text] = summary
+        while len(cache["exact"]) > SUMMARY_CACHE_SIZE:
+            cache["exact"].pop(next(iter(cache["exact"])))
+        if embedding is None:
+            return
+        if cache["embeddings"] is None:
+            cache["embeddings"] = embedding[np.newaxis, :]
+        else:
+            cache["embeddings"] = np.vstack([cache["embeddings"], embedding])[-SUMMARY_CACHE_SIZE:]
+        cache["summaries"] = (cache["summaries"] + [summary])[-SUMMARY_CACHE_SIZE:]
+
+# Matches the (possibly still unterminated) "claim" string of a partial JSON reply
+_PARTIAL_CLAIM = re.compile(r'"claim"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+def summarize(source_text, model_name):
+    summary, embedding = lookup_summary(source_text, model_name)
+    if summary is not None:
+        return summary
+
+    # Stream tokens as they arrive, but only ever show the claim: the raw JSON carries
+    # exact_quote, which Blind Mode (Control) must not see before the review step
+    placeholder = st.empty()
+    summary = ""
+    for chunk in get_llm(model_name).stream(build_messages(source_text)):
+        summary += chunk.content
+        match = _PARTIAL_CLAIM.search(summary)
+        if match:
+            placeholder.markdown(match.group(1).replace('\\"', '"').translate(_MARKDOWN_ESCAPE))
+    placeholder.empty()
+    store_summary(source_text, model_name, embedding, summary)
+    return summary
+
+# --- BATCH (ASYNC) AGENT ---
+# Runs search -> summary for many topics at once so their network round-trips overlap.
+# The semaphore caps in-flight requests to stay under Groq/Tavily rate limits.
+BATCH_CONCURRENCY = 10
+
+async def run_agent_async(llm, tavily, semaphore, topic):
+    async with semaphore:
+        try:
+            search_result = await tavily.search(query=topic, search_depth="basic", max_results=1)
+            results = search_result.get('results', [])
+            if not results:
+                return {"topic": topic, "agent_claim": "No results found.", "source_url": ""}
+            response = await llm.ainvoke(build_messages(truncate_source(results[0]['content'])))
+            claim, _ = parse_response(response.content)
+            return {"topic": topic, "agent_claim": claim, "source_url": results[0]['url']}
+        except Exception as e:
+            return {"topic": topic, "agent_claim": f"Error: {e}", "source_url": ""}
+
+async def run_all_agents(topics, model_name):
+    # Async clients are bound to the event loop they first ran on, so each batch builds its own
+    from tavily import AsyncTavilyClient
+    llm = build_llm(model_name)
+    tavily = AsyncTavilyClient(api_key=TAVILY_API_KEY)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    rows = []
+    for next_done in asyncio.as_completed([run_agent_async(llm, tavily, semaphore, t) for t in topics]):
+        row = await next_done
+        # Log each claim as soon as it lands; no human has reviewed it yet
+        if row["source_url"]:
+            append_log_row([
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                row["topic"],
+                row["agent_claim"],
+                row["source_url"],
+                "Pending Review",
+                "Batch Run",
+                "",
+                model_name
+            ])
+        rows.append(row)
+    return rows
 
 # --- CSV LOGGING SETUP ---
-CSV_FILE = "experiment_results3.csv"
+# New file for the model column, so earlier 70B-only logs are never mixed with it
+CSV_FILE = "experiment_results4.csv"
 
-if not os.path.exists(CSV_FILE):
-    with open(CSV_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
+# One long-lived, line-buffered handle per process; the lock keeps rows from
+# concurrent sessions from interleaving. Header is written only for a new file.
+@st.cache_resource(show_spinner=False)
+def get_log_writer():
+    f = open(CSV_FILE, "a", newline="", encoding="utf-8", buffering=1)
+    writer = csv.writer(f)
+    if f.tell() == 0:
         writer.writerow([
             "timestamp",
             "topic",
@@ -37,24 +288,52 @@ if not os.path.exists(CSV_FILE):
             "source_url",
             "human_verdict",
             "verification_mode",
-            "verification_time_seconds" # <-- NEW COLUMN FOR THE TIMER
+            "verification_time_seconds", # <-- NEW COLUMN FOR THE TIMER
+            "model"
         ])
+        f.flush()
+    return writer, f, threading.Lock()
+
+def append_log_row(row):
+    writer, f, lock = get_log_writer()
+    with lock:
+        writer.writerow(row)
+        f.flush()
+
+# --- TRAP DATASET ---
+# Parsed once per file version: mtime is part of the cache key, so editing the CSV invalidates it
+@st.cache_data(show_spinner=False)
+def load_traps(path, mtime):
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    with open(path, "r", encoding="utf-8") as f:
+        header = next(csv.reader(f), [])
+    q_col = "Question" if "Question" in header else "query"
+    if q_col not in header:
+        return []
+
+    # Columnar parse in C: only the question column is materialized, no per-row dicts
+    table = pacsv.read_csv(
+        path,
+        # Like csv.DictReader: quoted questions may span lines, ragged rows don't abort the load
+        parse_options=pacsv.ParseOptions(newlines_in_values=True, invalid_row_handler=lambda row: "skip"),
+        convert_options=pacsv.ConvertOptions(include_columns=[q_col], column_types={q_col: pa.string()})
+    )
+    return table.column(q_col).to_pylist()
 
 # --- UI HEADER ---
 st.title("🕵️ Source-Grounded Agent (HITL)")
 st.markdown("### Human-in-the-Loop Verification Experiment")
 st.markdown("---")
 
+# --- MODEL SELECTION ---
+high_accuracy = st.sidebar.toggle("🎯 High-accuracy mode (70B)", value=False, help="Turn off to use the faster 8B model for claim extraction.")
+model_name = LARGE_MODEL if high_accuracy else SMALL_MODEL
+
 # --- SESSION STATE MANAGEMENT ---
-if "step" not in st.session_state: st.session_state.step = "input" 
-if "topic" not in st.session_state: st.session_state.topic = ""
-if "research_data" not in st.session_state: st.session_state.research_data = None
-if "ai_summary" not in st.session_state: st.session_state.ai_summary = ""
-if "exact_quote" not in st.session_state: st.session_state.exact_quote = ""
-if "verification_status" not in st.session_state: st.session_state.verification_status = None
-if "experiment_mode" not in st.session_state: st.session_state.experiment_mode = "Source-Grounded (Experimental)"
-if "start_time" not in st.session_state: st.session_state.start_time = None # <-- TIMER START STATE
-if "verification_time" not in st.session_state: st.session_state.verification_time = None # <-- TIMER END STATE
+for key, value in SESSION_DEFAULTS.items():
+    st.session_state.setdefault(key, value)
 
 # --- STEP 1: INPUT PHASE ---
 if st.session_state.step == "input":
@@ -73,10 +352,7 @@ if st.session_state.step == "input":
     dataset_file = "adversarial_dataset2.csv" if os.path.exists("adversarial_dataset2.csv") else "queries.csv"
     
     if os.path.exists(dataset_file):
-        with open(dataset_file, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            q_col = "Question" if "Question" in reader.fieldnames else "query"
-            trap_questions = [row[q_col] for row in reader if q_col in row]
+        trap_questions = load_traps(dataset_file, os.path.getmtime(dataset_file))
 
     if trap_questions:
         use_dataset = st.checkbox(f"🧪 Load question from {dataset_file}", value=True)
@@ -91,53 +367,35 @@ if st.session_state.step == "input":
         if not topic_input:
             st.warning("Please enter a topic.")
         else:
-            with st.spinner("Agent is searching the web and generating a claim..."):
-                try:
-                    search_result = tavily.search(query=topic_input, search_depth="basic", max_results=1)
+            try:
+                with st.spinner("Agent is searching the web..."):
+                    results = run_search(topic_input)
                     
-                    if not search_result.get('results'):
-                        st.error("No results found. Try a different topic.")
-                        st.stop()
-
-                    st.session_state.topic = topic_input
-                    st.session_state.research_data = search_result['results'][0]
-                    # UPDATED SYSTEM PROMPT
-                    source_text = st.session_state.research_data['content']
-                    
-                    # Added JSON instructions back in so the highlighter works!
-                    prompt = f"""
-                    System Instruction: You are a strict financial verification assistant. You will be provided with a user query and raw source context. You must adhere strictly to the following rules:
-                    1. Base your answer solely on the provided raw context.
-                    2. Do not use any internal knowledge, external facts, or assumptions.
-                    3. Your final response must be exactly two sentences long.
-                    
-                    You MUST return your response as a valid JSON object with exactly two keys:
-                    "claim": "Your summary here",
-                    "exact_quote": "Copy and paste the EXACT word-for-word sentence from the text that proves your claim. If you cannot find one, leave this empty."
+                if not results:
+                    st.error("No results found. Try a different topic.")
+                    st.stop()
 
-                    Text Context:
-                    {source_text}
-                    """
+                st.session_state.topic = topic_input
+                st.session_state.research_data = results[0]
+                source_text = truncate_source(st.session_state.research_data['content'])
+                response_text = summarize(source_text, model_name)
+                st.session_state.agent_model = model_name
+                st.session_state.ai_summary, st.session_state.exact_quote = parse_response(response_text)
 
-                    response = llm.invoke(prompt)
-                    
-                    try:
-                        clean_text = response.content.replace('```json', '').replace('```', '').strip()
-                        parsed_data = json.loads(clean_text)
-                        
-                        st.session_state.ai_summary = parsed_data.get("claim", "Error extracting claim.")
-                        st.session_state.exact_quote = parsed_data.get("exact_quote", "")
-                    except json.JSONDecodeError:
-                        st.session_state.ai_summary = response.content
-                        st.session_state.exact_quote = ""
-
-                    # --- START TIMER EXACTLY WHEN AGENT FINISHES ---
-                    st.session_state.start_time = datetime.now()
-                    st.session_state.step = "review"
-                    st.rerun()
-
-                except Exception as e:
-                    st.error(f"Error: {e}")
+                # --- START TIMER EXACTLY WHEN AGENT FINISHES ---
+                st.session_state.start_time = datetime.now()
+                st.session_state.step = "review"
+                st.rerun()
+
+            except Exception as e:
+                st.error(f"Error: {e}")
+
+    # 3. Batch Run (fires every trap question concurrently and logs each claim to the CSV)
+    if trap_questions and st.button("⚡ Run All Traps"):
+        with st.spinner(f"Running the agent on {len(trap_questions)} trap questions..."):
+            batch_results = asyncio.run(run_all_agents(trap_questions, model_name))
+        st.success(f"Logged {sum(1 for r in batch_results if r['source_url'])} claims to {CSV_FILE} for later review.")
+        st.dataframe(batch_results, use_container_width=True)
 
 # --- STEP 2: VERIFICATION PHASE ---
 elif st.session_state.step == "review":
@@ -148,7 +406,7 @@ elif st.session_state.step == "review":
         
     st.markdown("<br>", unsafe_allow_html=True)
     
-    safe_summary = st.session_state.ai_summary.replace("$", "\$")
+    safe_summary = escape_markdown(st.session_state.ai_summary)
     
     # If Experimental Mode: Show Split Screen
     if st.session_state.experiment_mode == "Source-Grounded (Experimental)":
@@ -168,20 +426,16 @@ elif st.session_state.step == "review":
                 content = st.session_state.research_data['content']
                 quote = st.session_state.get('exact_quote', '')
                 
+                # Escape the scraped text first so only our own <mark> tag is rendered as HTML
+                safe_content = html.escape(content)
                 if quote and quote in content:
-                    highlight_html = f'<mark style="background-color: #ffeb3b; color: #000; padding: 0 4px; border-radius: 4px; font-weight: bold; box-shadow: 0 0 5px #ffeb3b;">{quote}</mark>'
-                    highlighted_content = content.replace(quote, highlight_html)
+                    highlight_html = f'<mark style="background-color: #ffeb3b; color: #000; padding: 0 4px; border-radius: 4px; font-weight: bold; box-shadow: 0 0 5px #ffeb3b;">{html.escape(quote)}</mark>'
+                    highlighted_content = safe_content.replace(html.escape(quote), highlight_html)
                 else:
-                    highlighted_content = content 
+                    highlighted_content = safe_content 
                 
-                st.markdown(
-                    f"""
-                    <div style="border: 1px solid #ddd; border-radius: 8px; padding: 20px; height: 400px; overflow-y: auto; background-color: #f9f9f9; color: #2c3e50; font-family: 'Arial', sans-serif; font-size: 15px; line-height: 1.6; box-shadow: inset 0 0 10px rgba(0,0,0,0.05);">
-                        {highlighted_content}
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
+                # Static iframe component: skips the markdown parser entirely
+                components.html(READER_TPL.substitute(content=highlighted_content), height=420, scrolling=True)
                 
                 if not quote or quote not in content:
                     st.caption("⚠️ *AI could not pinpoint an exact quote for this claim. Verify carefully!*")
@@ -205,17 +459,27 @@ elif st.session_state.step == "review":
             time_taken = 0.0
         st.session_state.verification_time = time_taken
 
-        with open(CSV_FILE, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                st.session_state.topic,
-                st.session_state.ai_summary,
-                st.session_state.research_data['url'],
-                verdict,
-                st.session_state.experiment_mode,
-                time_taken # <-- RECORD THE TIME TO CSV
-            ])
+        append_log_row([
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            st.session_state.topic,
+            st.session_state.ai_summary,
+            st.session_state.research_data['url'],
+            verdict,
+            st.session_state.experiment_mode,
+            time_taken, # <-- RECORD THE TIME TO CSV
+            st.session_state.agent_model
+        ])
+
+        # Serialized once here; the Step 3 screen just re-displays the cached string
+        st.session_state.log_json = dump_json({
+            "topic": st.session_state.topic,
+            "agent_claim": st.session_state.ai_summary,
+            "source_url": st.session_state.research_data['url'],
+            "human_verdict": verdict,
+            "mode_used": st.session_state.experiment_mode,
+            "verification_time_seconds": time_taken, # <-- SHOW TIME ON SCREEN
+            "model": st.session_state.agent_model
+        })
 
     c1, c2, c3 = st.columns(3)
 
@@ -244,15 +508,7 @@ elif st.session_state.step == "verified":
     else:
         st.error("⚠️ Correction! The human verifier rejected the claim.")
         
-    log_data = {
-        "topic": st.session_state.topic,
-        "agent_claim": st.session_state.ai_summary,
-        "source_url": st.session_state.research_data['url'],
-        "human_verdict": st.session_state.verification_status,
-        "mode_used": st.session_state.experiment_mode,
-        "verification_time_seconds": st.session_state.verification_time # <-- SHOW TIME ON SCREEN
-    }
-    st.json(log_data)
+    st.code(st.session_state.log_json, language="json")
     
     st.markdown("---")
     # FIXED BUTTON AND STATE RESET
@@ -1,10 +1,20 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import os
 import csv
+import json
+import html
+import atexit
+import hashlib
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from tavily import TavilyClient
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # --- PAGE CONFIGURATION (Must be the first Streamlit command) ---
 st.set_page_config(layout="wide", page_title="Agent Verification Lab")
@@ -20,23 +30,181 @@ if not GROQ_API_KEY or not TAVILY_API_KEY:
     st.stop()
 
 # --- INITIALIZE CLIENTS ---
-llm = ChatGroq(temperature=0, model_name="llama-3.3-70b-versatile", groq_api_key=GROQ_API_KEY)
-tavily = TavilyClient(api_key=TAVILY_API_KEY)
+MODEL_NAME = "llama-3.3-70b-versatile"
+TEMPERATURE = 0
+
+# Created once per process; the SDKs are imported here rather than at module top so
+# a cold start (and reruns that never call the agent) skip the langchain/tavily imports.
+# Separate factories so the background search prefetch never has to build the LLM client.
+@st.cache_resource(show_spinner=False)
+def get_llm():
+    from langchain_groq import ChatGroq
+    return ChatGroq(temperature=TEMPERATURE, model_name=MODEL_NAME, groq_api_key=GROQ_API_KEY)
+
+@st.cache_resource(show_spinner=False)
+def get_tavily():
+    from tavily import TavilyClient
+    return TavilyClient(api_key=TAVILY_API_KEY)
+
+# --- SEARCH CACHE ---
+# Users often rerun the same topic (especially trap questions), so identical searches are memoized
+# _prefetched is excluded from the cache key (leading underscore): it lets a result
+# fetched in the background be stored in the cache from the script thread.
+@st.cache_data(ttl=60 * 60, show_spinner=False)
+def cached_tavily_search(query, depth="basic", k=1, _prefetched=None):
+    if _prefetched is not None:
+        return _prefetched
+    return get_tavily().search(query=query, search_depth=depth, max_results=k)
+
+# --- SEARCH PREFETCH ---
+# When the user changes the topic, the search starts in the background, so by the time
+# "Start Agent" is clicked the Tavily round-trip has usually already finished. The worker
+# only calls the plain client; Streamlit caches are touched on the script thread.
+@st.cache_resource(show_spinner=False)
+def get_executor():
+    return ThreadPoolExecutor(max_workers=4)
+
+def prefetch_search(topic):
+    tavily = get_tavily()
+    st.session_state.prefetch = (topic, get_executor().submit(tavily.search, query=topic, search_depth="basic", max_results=1))
+
+def get_search_result(topic):
+    prefetched = None
+    pending = st.session_state.get("prefetch")
+    if pending is not None and pending[0] == topic:
+        try:
+            prefetched = pending[1].result()
+        except Exception:
+            prefetched = None # A failed prefetch just falls back to a normal search
+    return cached_tavily_search(topic, _prefetched=prefetched)
+
+# --- PROMPT ---
+# Don't put per-request values in here, it keeps the prompt prefix cacheable
+SYSTEM_PROMPT = """You are a rigorous financial research assistant.
+Based ONLY on the following text, extract the key factual claim.
+Do not add outside knowledge.
+Limit to 2 sentences."""
+
+# ~1500 tokens at ~4 chars/token: plenty for a 2-sentence claim, and it caps
+# input-token latency and cost when Tavily returns a very long page
+MAX_SOURCE_CHARS = 6000
+
+# --- RESPONSE CACHE ---
+# Same (model, temperature, prompt, text) -> same summary, so repeats skip the Groq call.
+# A plain dict (not st.cache_data) because a miss streams tokens to the page, which
+# st.cache_data can't replay. Oldest entries are evicted first once it is full.
+SUMMARY_CACHE_SIZE = 512
+
+@st.cache_resource(show_spinner=False)
+def get_summary_cache():
+    # Shared by every session's script thread, so all access goes through the lock
+    return {"lock": threading.Lock(), "entries": {}}
+
+def summarize(model, temperature, source_text):
+    cache = get_summary_cache()
+    key = hashlib.sha256(f"{model}\0{temperature}\0{SYSTEM_PROMPT}\0{source_text}".encode("utf-8")).hexdigest()
+    with cache["lock"]:
+        summary = cache["entries"].get(key)
+    if summary is None:
+        messages = [("system", SYSTEM_PROMPT), ("human", f"Text:\n{source_text}")]
+        summary = st.write_stream(chunk.content for chunk in get_llm().stream(messages))
+        with cache["lock"]:
+            cache["entries"][key] = summary
+            while len(cache["entries"]) > SUMMARY_CACHE_SIZE:
+                cache["entries"].pop(next(iter(cache["entries"])))
+    return summary
 
 # --- CSV LOGGING SETUP ---
 CSV_FILE = "experiment_results.csv"
+CSV_HEADER = [
+    "timestamp",
+    "topic",
+    "agent_claim",
+    "source_url",
+    "human_verdict",
+    "verification_mode"
+]
+
+# Opened once per process, every verdict is flushed right away
+@st.cache_resource(show_spinner=False)
+def get_log_writer():
+    f = open(CSV_FILE, "a", newline="", encoding="utf-8", buffering=1)
+    writer = csv.writer(f)
+    if f.tell() == 0:
+        writer.writerow(CSV_HEADER)
+        f.flush()
+    atexit.register(f.close)
+    return writer, f, threading.Lock()
+
+def save_result(row):
+    writer, f, lock = get_log_writer()
+    with lock:
+        writer.writerow(row)
+        f.flush()
+
+# --- TRAP DATASET ---
+# mtime arg re-reads the file after it is regenerated
+@st.cache_resource(show_spinner=False)
+def load_traps(path, mtime):
+    with open(path, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        return tuple(row["Question"] for row in reader if "Question" in row)
 
-if not os.path.exists(CSV_FILE):
-    with open(CSV_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "timestamp",
-            "topic",
-            "agent_claim",
-            "source_url",
-            "human_verdict",
-            "verification_mode"
+# --- READER MODE TEMPLATE ---
+READER_TEMPLATE = """
+<div style="border: 1px solid #ddd; border-radius: 8px; padding: 20px; height: 400px; overflow-y: auto; background-color: #f9f9f9; color: #2c3e50; font-family: 'Arial', sans-serif; font-size: 15px; line-height: 1.6; box-shadow: inset 0 0 10px rgba(0,0,0,0.05);">
+    {body}
+</div>
+"""
+
+# --- LOG DISPLAY ---
+def dump_json(record):
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(record, indent=2, ensure_ascii=False)
+
+# --- VERIFICATION PANEL ---
+# A fragment: a click inside it re-runs only this panel instead of the whole script
+# (client setup, Reader Mode iframe, ...). Each handler then moves to another step, so it
+# still ends with an app-wide st.rerun(); a fragment-scoped rerun would stay on Step 2.
+@st.fragment
+def verification_panel():
+    st.write("### 🔍 Verification Decision")
+
+    def log_to_csv(verdict):
+        save_result([
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            st.session_state.topic,
+            st.session_state.ai_summary,
+            st.session_state.research_data['url'],
+            verdict,
+            st.session_state.experiment_mode # Logs whether they had Reader Mode or not!
         ])
+        st.session_state.log_json = dump_json({
+            "topic": st.session_state.topic,
+            "agent_claim": st.session_state.ai_summary,
+            "source_url": st.session_state.research_data['url'],
+            "human_verdict": verdict,
+            "mode_used": st.session_state.experiment_mode
+        })
+
+    c1, c2, c3 = st.columns(3)
+
+    if c1.button("✅ Approve"):
+        log_to_csv("Verified Accurate")
+        st.session_state.verification_status = "Verified Accurate"
+        st.session_state.step = "verified"
+        st.rerun()
+
+    if c2.button("❌ Reject"):
+        log_to_csv("Hallucination Detected")
+        st.session_state.verification_status = "Hallucination Detected"
+        st.session_state.step = "verified"
+        st.rerun()
+
+    if c3.button("🔄 Restart"):
+        st.session_state.step = "input"
+        st.rerun()
 
 # --- UI HEADER ---
 st.title("🕵️ Source-Grounded Agent (HITL)")
@@ -56,6 +224,8 @@ if "verification_status" not in st.session_state:
     st.session_state.verification_status = None
 if "experiment_mode" not in st.session_state:
     st.session_state.experiment_mode = "Source-Grounded (Experimental)"
+if "log_json" not in st.session_state:
+    st.session_state.log_json = ""
 
 # --- STEP 1: INPUT PHASE ---
 if st.session_state.step == "input":
@@ -72,9 +242,7 @@ if st.session_state.step == "input":
     # 2. Trap Question Loader (Dropdown)
     trap_questions = []
     if os.path.exists("adversarial_dataset.csv"):
-        with open("adversarial_dataset.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            trap_questions = [row["Question"] for row in reader if "Question" in row]
+        trap_questions = load_traps("adversarial_dataset.csv", os.path.getmtime("adversarial_dataset.csv"))
 
     if trap_questions:
         use_dataset = st.checkbox("🧪 Load question from Adversarial Dataset", value=True)
@@ -84,6 +252,13 @@ if st.session_state.step == "input":
             topic_input = st.text_input("Enter a custom topic to research:")
     else:
         topic_input = st.text_input("Enter a topic to research:", placeholder="e.g., What was Nvidia's reported Data Center revenue in Q4 2024?")
+
+    # Prefetch only when the user actually changes the topic: the selectbox always has a
+    # default, so merely loading the page must not spend a Tavily search
+    previous_topic = st.session_state.get("last_topic_input")
+    st.session_state.last_topic_input = topic_input
+    if topic_input and previous_topic is not None and topic_input != previous_topic:
+        prefetch_search(topic_input)
     
     if st.button("🚀 Start Agent"):
         if not topic_input:
@@ -91,27 +266,20 @@ if st.session_state.step == "input":
         else:
             with st.spinner("Agent is searching the web and generating a claim..."):
                 try:
-                    search_result = tavily.search(query=topic_input, search_depth="basic", max_results=1)
+                    search_result = get_search_result(topic_input)
                     
                     if not search_result.get('results'):
                         st.error("No results found. Try a different topic.")
                         st.stop()
 
                     st.session_state.topic = topic_input
-                    st.session_state.research_data = search_result['results'][0]
+                    # The truncated prompt text is computed once and kept with the research payload
+                    research_data = dict(search_result['results'][0])
+                    research_data['content_trunc'] = research_data['content'][:MAX_SOURCE_CHARS]
+                    st.session_state.research_data = research_data
                     
-                    source_text = st.session_state.research_data['content']
-                    prompt = f"""
-                    You are a rigorous financial research assistant.
-                    Based ONLY on the following text, extract the key factual claim.
-                    Do not add outside knowledge.
-                    Limit to 2 sentences.
-                    Text:
-                    {source_text}
-                    """
-
-                    response = llm.invoke(prompt)
-                    st.session_state.ai_summary = response.content
+                    source_text = research_data['content_trunc']
+                    st.session_state.ai_summary = summarize(MODEL_NAME, TEMPERATURE, source_text)
                     st.session_state.step = "review"
                     st.rerun()
 
@@ -144,14 +312,12 @@ elif st.session_state.step == "review":
             if st.session_state.research_data:
                 url = st.session_state.research_data['url']
                 st.markdown(f"**Source URL:** [{url}]({url})")
-                content = st.session_state.research_data['content']
-                st.markdown(
-                    f"""
-                    <div style="border: 1px solid #ddd; border-radius: 8px; padding: 20px; height: 400px; overflow-y: auto; background-color: #f9f9f9; color: #2c3e50; font-family: 'Arial', sans-serif; font-size: 15px; line-height: 1.6; box-shadow: inset 0 0 10px rgba(0,0,0,0.05);">
-                        {content}
-                    </div>
-                    """,
-                    unsafe_allow_html=True
+                content = st.session_state.research_data['content_trunc']
+                # Scraped text is escaped (no HTML injection) and shown in a static iframe component
+                components.html(
+                    READER_TEMPLATE.format(body=html.escape(content).replace("\n", "<br>")),
+                    height=420,
+                    scrolling=True
                 )
                 st.caption("This window shows the exact raw text the AI analyzed.")
                 
@@ -164,37 +330,7 @@ elif st.session_state.step == "review":
             st.markdown(f"**Source URL:** [{st.session_state.research_data['url']}]({st.session_state.research_data['url']})")
     
     st.markdown("---")
-    st.write("### 🔍 Verification Decision")
-
-    def log_to_csv(verdict):
-        with open(CSV_FILE, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                st.session_state.topic,
-                st.session_state.ai_summary,
-                st.session_state.research_data['url'],
-                verdict,
-                st.session_state.experiment_mode # Logs whether they had Reader Mode or not!
-            ])
-
-    c1, c2, c3 = st.columns(3)
-
-    if c1.button("✅ Approve"):
-        log_to_csv("Verified Accurate")
-        st.session_state.verification_status = "Verified Accurate"
-        st.session_state.step = "verified"
-        st.rerun()
-
-    if c2.button("❌ Reject"):
-        log_to_csv("Hallucination Detected")
-        st.session_state.verification_status = "Hallucination Detected"
-        st.session_state.step = "verified"
-        st.rerun()
-
-    if c3.button("🔄 Restart"):
-        st.session_state.step = "input"
-        st.rerun()
+    verification_panel()
 
 # --- STEP 3: LOGGING PHASE ---
 elif st.session_state.step == "verified":
@@ -205,14 +341,7 @@ elif st.session_state.step == "verified":
     else:
         st.error("⚠️ Correction! The human verifier rejected the claim.")
         
-    log_data = {
-        "topic": st.session_state.topic,
-        "agent_claim": st.session_state.ai_summary,
-        "source_url": st.session_state.research_data['url'],
-        "human_verdict": st.session_state.verification_status,
-        "mode_used": st.session_state.experiment_mode
-    }
-    st.json(log_data)
+    st.code(st.session_state.log_json, language="json")
     
     st.markdown("---")
     if st.button("🔬 Test Another Topic"):
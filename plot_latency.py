@@ -4,7 +4,7 @@ import seaborn as sns
 import sys
 
 # 1. Load the data
-file_name = "experiment_results3.csv"
+file_name = "experiment_results4.csv"
 try:
     df = pd.read_csv(file_name)
 except FileNotFoundError: